@@ -1,15 +1,17 @@
 import asyncio
 
-import hfa_itls
-import tool_itls
+from . import hfa_itls
+from . import tool_itls
+from . import snapshot
+from .globals import SNAPSHOT_PATH, SNAPSHOT_INTERVAL
 
-# All the actual work is done by hfa_itls.py and tool_itls. We just need to wait and
-# let them do their thing.
+# All the actual work is done by hfa_itls.py and tool_itls. We just need to restore
+# the last snapshot, then keep it up to date while they do their thing.
 
 
 async def main():
-    while True:
-        await asyncio.sleep(999)
+    await snapshot.warm_start(SNAPSHOT_PATH)
+    await snapshot.run_snapshots(SNAPSHOT_PATH, SNAPSHOT_INTERVAL)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+import asyncio
+import heapq
+from time import time
+import traceback
+
+from .globals import *
+from .utils import create_background_task
+
+REPORT_INTERVAL = 60
+
+
+class AdmissionController:
+    """Bounds the work a stream can queue up for an assistant.
+
+    Work arrives in units: a single message, or a batch of messages answered in
+    one turn. Units are answered one at a time, highest priority first. Once
+    `maxInFlight` units are waiting, a new unit either displaces the lowest
+    priority waiting unit or is shed itself. Messages whose deadline passes
+    before they're answered are expired. Shed and expired messages are sent to
+    the overflow stream if one is configured.
+    """
+
+    def __init__(self, stream_config, handler):
+        self.stream_config = stream_config
+        self.handler = handler
+
+        self.queue = []
+        self.sequence = 0
+        self.in_flight = 0
+        self.worker = None
+
+        self.admitted = 0
+        self.shed = 0
+        self.expired = 0
+        self.reported = (time(), self.counters())
+        self.overflow_url = self._get_overflow_url()
+
+    def counters(self):
+        return {
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "expired": self.expired,
+            "inFlight": self.in_flight,
+        }
+
+    def close(self):
+        """Divert everything still waiting, for an assistant that's going away."""
+        while self.queue:
+            _, _, entries = heapq.heappop(self.queue)
+            self.in_flight -= 1
+            self._shed(self._drop_expired(entries))
+
+        self._report()
+
+    def stamp(self, message: dict):
+        """Attach a deadline to a message as it arrives."""
+        return (self._get_deadline(message, time()), message)
+
+    def offer(self, entries: list):
+        entries = self._drop_expired(entries)
+        if not entries:
+            self._report()
+            return False
+
+        priority = max(self._get_priority(message) for _, message in entries)
+
+        max_in_flight = self.stream_config.maxInFlight
+        if max_in_flight != None and self.in_flight >= max_in_flight:
+            # Queue items sort by (-priority, sequence), so the largest is the
+            # newest of the lowest priority units
+            lowest = max(self.queue) if self.queue else None
+            if lowest == None or -lowest[0] >= priority:
+                self._shed(entries)
+                self._report()
+                return False
+
+            self.queue.remove(lowest)
+            heapq.heapify(self.queue)
+            self.in_flight -= 1
+            self._shed(self._drop_expired(lowest[2]))
+
+        self.sequence += 1
+        heapq.heappush(self.queue, (-priority, self.sequence, entries))
+        self.in_flight += 1
+
+        if self.worker == None:
+            self.worker = create_background_task(self._work())
+
+        self._report()
+        return True
+
+    async def _work(self):
+        try:
+            while self.queue:
+                _, _, entries = heapq.heappop(self.queue)
+
+                try:
+                    entries = self._drop_expired(entries)
+                    if entries:
+                        self.admitted += len(entries)
+                        await self.handler([message for _, message in entries])
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    self.in_flight -= 1
+
+                self._report()
+
+                # Give newly arrived messages a chance to be offered
+                await asyncio.sleep(0)
+        finally:
+            self.worker = None
+
+    def _drop_expired(self, entries):
+        now = time()
+        result = []
+
+        for deadline, message in entries:
+            if deadline != None and deadline <= now:
+                self.expired += 1
+                self._divert(message)
+            else:
+                result.append((deadline, message))
+
+        return result
+
+    def _shed(self, entries):
+        for _, message in entries:
+            self.shed += 1
+            self._divert(message)
+
+    def _report(self):
+        reported_at, reported_counters = self.reported
+        if time() - reported_at < REPORT_INTERVAL:
+            return
+
+        counters = self.counters()
+        if counters == reported_counters:
+            return
+
+        self.reported = (time(), counters)
+        print(f"Admission for {self.stream_config.streamName}:", counters)
+
+    def _get_priority(self, message):
+        priority_field = self.stream_config.priorityField
+        if priority_field == None:
+            return 0
+
+        try:
+            return float(message.get(priority_field, 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def _get_deadline(self, message, now):
+        deadlines = []
+
+        if self.stream_config.maxQueueAge != None:
+            deadlines.append(now + self.stream_config.maxQueueAge)
+
+        deadline_field = self.stream_config.deadlineField
+        if deadline_field != None and deadline_field in message:
+            try:
+                deadlines.append(float(message[deadline_field]))
+            except (TypeError, ValueError):
+                print("Ignoring invalid deadline:", message[deadline_field])
+
+        return min(deadlines) if deadlines else None
+
+    def _get_overflow_url(self):
+        global streams
+
+        stream_config = self.stream_config
+        overflow_stream = stream_config.overflowStream
+        if overflow_stream == None:
+            return None
+
+        if (
+            stream_config.maxInFlight == None
+            and stream_config.maxQueueAge == None
+            and stream_config.deadlineField == None
+        ):
+            print(
+                f"Stream {stream_config.streamName} never sheds or expires messages,",
+                "so its overflowStream is unused",
+            )
+            return None
+
+        try:
+            return streams[overflow_stream].get_send_url()
+        except Exception:
+            traceback.print_exc()
+            print(
+                f"Can't send to overflow stream {overflow_stream},",
+                f"so {stream_config.streamName} will drop shed and expired messages",
+            )
+            return None
+
+    def _divert(self, message):
+        global itl
+
+        if self.overflow_url == None:
+            return
+
+        try:
+            itl.stream_send(self.overflow_url, message)
+        except Exception:
+            traceback.print_exc()
@@ -4,6 +4,8 @@ from itllib import Itl, SyncedResources
 CLUSTER = "assistants"
 CONFIG_PATH = os.path.join("config.yaml")
 SECRETS_PATH = "./secrets"
+SNAPSHOT_PATH = os.environ.get("ASSISTANTS_SNAPSHOT_PATH", "./snapshot.itls")
+SNAPSHOT_INTERVAL = float(os.environ.get("ASSISTANTS_SNAPSHOT_INTERVAL", 60))
 
 itl = Itl()
 itl.apply_config(CONFIG_PATH, SECRETS_PATH)
@@ -16,3 +18,9 @@ assistants = SyncedResources()
 configs = SyncedResources()
 loops = SyncedResources()
 streams = SyncedResources()
+
+# Assistants restored from a snapshot, waiting to be claimed by the HFAssistant
+# controller once the cluster syncs them
+warm_assistants = {}
+# Names of assistants the HFAssistant controller has created or is creating
+claimed_assistants = set()
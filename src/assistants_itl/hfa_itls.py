@@ -14,8 +14,28 @@ class HFAController(ResourceController):
     async def create_resource(self, config):
         if "spec" not in config:
             raise ValueError("Config is missing required key: spec")
-        result = HFAssistant(HFAssistantConfig(**config["spec"]))
-        await result.connect()
+        name = config.get("metadata", {}).get("name")
+        spec = HFAssistantConfig(**config["spec"])
+        claimed_assistants.add(name)
+
+        # Reuse an assistant that was warm-started from a snapshot, keeping the
+        # task history it accumulated before the restart
+        warm = warm_assistants.pop(name, None)
+        warm_examples = warm.examples if warm != None else []
+
+        if warm != None and warm.streams == spec.streams:
+            result = warm
+            result.configure(spec)
+        else:
+            if warm != None:
+                warm.disconnect()
+            result = HFAssistant(spec, name)
+            await result.connect()
+
+        for example in warm_examples:
+            if example not in result.examples:
+                result.examples.append(example)
+
         return result
 
     async def update_resource(self, resource: HFAssistant, config):
@@ -24,7 +44,8 @@ class HFAController(ResourceController):
         resource.configure(HFAssistantConfig(**config["spec"]))
 
     async def delete_resource(self, resource):
-        print("You'll need to restart the script to complete deletion of an assistant")
+        resource.disconnect()
+        claimed_assistants.discard(resource.name)
         return super().delete_resource(resource)
 
 
@@ -8,17 +8,27 @@ import random
 from uuid import uuid1
 from time import time
 import asyncio
+import traceback
 
 from transformers.tools import Tool, OpenAiAgent, agents
 from itllib import Itl, ResourceController
 import yaml
 
 from .globals import *
-from .utils import ConfigTemplate
+from .admission import AdmissionController
+from .profiling import ChatProfiler, ProfileConfig
+from .utils import ConfigTemplate, run_in_thread
 
 NODE_ID = f"{int(time()*1000)}-{random.randint(0, 1000000000000)}"
 SEQUENCE = 0
 
+# Chats run in a worker thread, one at a time, since _capture_response patches
+# the agents module. Created on first use so it binds to the running loop.
+_CHAT_LOCK = None
+
+# How long a partial batch waits for more messages when only batchMax is set
+DEFAULT_BATCH_LINGER = 1.0
+
 
 def _create_task_id():
     global NODE_ID, SEQUENCE
@@ -41,6 +51,7 @@ class HFAssistantConfig(BaseModel):
     header: str
     tools: dict[str, str]
     examples: list[str]
+    profile: Union[ProfileConfig, str] = None
 
 
 class TaskLog(BaseModel):
@@ -48,6 +59,7 @@ class TaskLog(BaseModel):
     tools: dict[str, str] = {}
     steps: Optional[str] = None
     code: Optional[str] = None
+    messages: Optional[list[dict]] = None
 
 
 class Stream(BaseModel):
@@ -56,6 +68,31 @@ class Stream(BaseModel):
     groupName: str = None
     incomingFormat: str = None
     incomingFilter: Union[str, list, dict] = None
+    batchLinger: float = None
+    batchMax: int = None
+    batchSeparator: str = "\n"
+    maxInFlight: int = None
+    maxQueueAge: float = None
+    deadlineField: str = None
+    priorityField: str = None
+    overflowStream: str = None
+
+    def is_batched(self):
+        return self.batchLinger != None or self.batchMax != None
+
+    def get_batch_linger(self):
+        if self.batchLinger != None:
+            return self.batchLinger
+        return DEFAULT_BATCH_LINGER
+
+    def is_admission_controlled(self):
+        return (
+            self.maxInFlight != None
+            or self.maxQueueAge != None
+            or self.deadlineField != None
+            or self.priorityField != None
+            or self.overflowStream != None
+        )
 
     def get_connect_url(self):
         loop = loops.get(self.loopSecret)
@@ -77,13 +114,18 @@ class Stream(BaseModel):
 
 
 class HFAssistant:
-    def __init__(self, config: HFAssistantConfig):
+    def __init__(self, config: HFAssistantConfig, name: str = None):
         global tools, prompts, tasklogs
 
+        self.name = name
+        self.config = config
+        self.connected = False
         self.header = ConfigTemplate(config.header)
         self.streams = config.streams
         self.tools = config.tools
         self.examples = config.examples
+        self.profiler = ChatProfiler(config.profile)
+        self.admission = {}
 
         self.agent = _create_agent(config.codeModel)
         self.available_tools = tools
@@ -93,31 +135,63 @@ class HFAssistant:
         # TODO: expose streams as tools
 
     async def connect(self):
-        tasks = []
+        global streams
+
+        self.connected = True
+
+        # Streams already synced (or restored from a snapshot) don't need a read
+        stream_configs = {}
+        tasks = {}
 
         for stream_config_path in self.streams:
-            tasks.append(itl.resource_read(CLUSTER, *stream_config_path.split("/")))
+            if stream_config_path in streams:
+                stream_configs[stream_config_path] = streams[stream_config_path]
+            else:
+                tasks[stream_config_path] = itl.resource_read(
+                    CLUSTER, *stream_config_path.split("/")
+                )
 
-        results = await asyncio.gather(*tasks)
-        for i, stream_config_json in enumerate(results):
+        results = await asyncio.gather(*tasks.values())
+        for stream_config_path, stream_config_json in zip(tasks, results):
             if stream_config_json == None:
-                raise ValueError("Missing stream config for", self.streams[i])
+                raise ValueError("Missing stream config for", stream_config_path)
             if "spec" not in stream_config_json:
-                raise ValueError("Missing spec in stream config for", self.streams[i])
+                raise ValueError(
+                    "Missing spec in stream config for", stream_config_path
+                )
 
-            stream_config = Stream(**stream_config_json["spec"])
-            self._handle_messages(stream_config)
+            stream_configs[stream_config_path] = Stream(**stream_config_json["spec"])
+
+        for stream_config_path in self.streams:
+            self._handle_messages(stream_configs[stream_config_path])
+
+    def disconnect(self):
+        # Stream handlers stay registered, but ignore messages from now on, and
+        # queued or batched work is never answered
+        self.connected = False
+
+        for admission in self.admission.values():
+            admission.close()
 
     def configure(self, config: HFAssistantConfig):
         if self.streams != config.streams:
             raise ValueError("Cannot change streams after initialization")
 
+        self.config = config
         self.tools = config.tools
         self.examples = config.examples
         self.header = ConfigTemplate(config.header)
         self.agent = _create_agent(config.codeModel)
+        self.profiler = ChatProfiler(config.profile)
 
     def chat(self, message: str):
+        if self.profiler.active():
+            with self.profiler.capture(message):
+                return self._chat(message)
+
+        return self._chat(message)
+
+    def _chat(self, message: str):
         # TODO: Tasks coming in from the stream should append to the history, tasks
         # coming in from the TaskLog controller should not
 
@@ -195,12 +269,98 @@ class HFAssistant:
 
         return "\n\n".join(tasks) + "\n"
 
+    async def _publish_tasklog(self, tasklog):
+        tasklog_config = {
+            "apiVersion": "assistants.thatone.ai/v1",
+            "kind": "TaskLog",
+            "metadata": {"name": _create_task_id()},
+            # Only batched logs record the messages they covered
+            "spec": tasklog.model_dump(
+                exclude={"messages"} if tasklog.messages == None else None
+            ),
+        }
+
+        # Push the log to the cluster
+        await itl.resource_create(CLUSTER, tasklog_config, attach_prefix=True)
+
+        # Add the log to the list of known tasklogs
+        tasklog_name = itl.attach_cluster_prefix(
+            CLUSTER, tasklog_config["metadata"]["name"]
+        )
+        tasklog_id = f"assistants.thatone.ai/v1/TaskLog/{tasklog_name}"
+        tasklogs[tasklog_id] = tasklog
+
+        # Add the log to the history
+        self.examples.append(tasklog_id)
+
     def _handle_messages(self, stream_config):
         incoming_template = ConfigTemplate(stream_config.incomingFormat or "${message}")
         incoming_filter = stream_config.incomingFilter
+        batched = stream_config.is_batched()
+
+        # Messages waiting to be answered together in a single turn
+        batch = []
+        flush_task = None
+
+        async def respond(messages):
+            if not self.connected:
+                return
+
+            incoming = stream_config.batchSeparator.join(
+                incoming_template.substitute(**message) for message in messages
+            )
+            async with _get_chat_lock():
+                tasklog = await run_in_thread(self.chat, incoming)
+
+            if batched:
+                tasklog.messages = messages
+
+            # The assistant may have been replaced or deleted during the chat
+            if not self.connected:
+                return
+
+            await self._publish_tasklog(tasklog)
+
+        admission = None
+        if stream_config.is_admission_controlled():
+            admission = AdmissionController(stream_config, respond)
+            self.admission[stream_config.streamName] = admission
+
+        async def submit(pending):
+            # Under admission control, each batch is a single unit of work
+            if admission != None:
+                admission.offer(pending)
+            else:
+                await respond(pending)
+
+        def take_batch():
+            nonlocal batch, flush_task
+
+            if flush_task != None:
+                flush_task.cancel()
+                flush_task = None
+
+            pending, batch = batch, []
+            return pending
+
+        async def flush_later():
+            nonlocal flush_task
+
+            await asyncio.sleep(stream_config.get_batch_linger())
+            flush_task = None
+
+            try:
+                await submit(take_batch())
+            except Exception:
+                traceback.print_exc()
 
         @itl.ondata(stream_config.get_connect_url())
         async def ondata(*args, **kwargs):
+            nonlocal flush_task
+
+            if not self.connected:
+                return
+
             if args and not kwargs:
                 if len(args) != 1:
                     return
@@ -216,32 +376,32 @@ class HFAssistant:
             if not isinstance(message, dict):
                 message = {"message": message}
 
-            incoming = incoming_template.substitute(**message)
-            tasklog = self.chat(incoming)
+            # Deadlines count from when the message arrived, not when it's batched
+            if admission != None:
+                message = admission.stamp(message)
 
-            tasklog_config = {
-                "apiVersion": "assistants.thatone.ai/v1",
-                "kind": "TaskLog",
-                "metadata": {"name": _create_task_id()},
-                "spec": tasklog.model_dump(),
-            }
-
-            # Push the log to the cluster
-            await itl.resource_create(CLUSTER, tasklog_config, attach_prefix=True)
+            if not batched:
+                await submit([message])
+                return
 
-            # Add the log to the list of known tasklogs
-            tasklog_name = itl.attach_cluster_prefix(
-                CLUSTER, tasklog_config["metadata"]["name"]
-            )
-            tasklog_id = f"assistants.thatone.ai/v1/TaskLog/{tasklog_name}"
-            tasklogs[tasklog_id] = tasklog
+            batch.append(message)
 
-            # Add the log to the history
-            self.examples.append(tasklog_id)
+            if stream_config.batchMax != None and len(batch) >= stream_config.batchMax:
+                await submit(take_batch())
+            elif flush_task == None:
+                looper = asyncio.get_event_loop()
+                flush_task = looper.create_task(flush_later())
 
         return ondata
 
 
+def _get_chat_lock():
+    global _CHAT_LOCK
+    if _CHAT_LOCK == None:
+        _CHAT_LOCK = asyncio.Lock()
+    return _CHAT_LOCK
+
+
 def _check_filter(message, filter):
     if filter == None:
         return True
@@ -0,0 +1,134 @@
+import copy
+import cProfile
+from contextlib import contextmanager
+import io
+import os
+import pstats
+import random
+from time import time
+import traceback
+from typing import Union
+from pydantic import BaseModel
+
+from .globals import *
+from .utils import create_background_task
+
+
+class ProfileConfig(BaseModel):
+    calls: int = 1
+    directory: str = "./profiles"
+    publish: bool = False
+    top: int = 30
+
+
+class ProfileLog(BaseModel):
+    prompt: str
+    path: str
+    duration: float
+    summary: str
+
+
+class ChatProfiler:
+    """Captures cProfile profiles for the next `calls` invocations of a chat.
+
+    The profile can be given inline or as the path of a Config resource. A Config
+    resource is re-read on each chat, and editing it re-arms the profiler.
+    """
+
+    def __init__(self, profile: Union[ProfileConfig, str, None]):
+        self.profile = profile
+        self.spec = None
+        self.config = None
+        self.remaining = 0
+
+        if isinstance(profile, ProfileConfig):
+            self._arm(profile)
+
+    def active(self):
+        if self.profile == None:
+            return False
+
+        if isinstance(self.profile, str):
+            self._refresh()
+
+        return self.remaining > 0
+
+    @contextmanager
+    def capture(self, message: str):
+        self.remaining -= 1
+        profiler = cProfile.Profile()
+        start = time()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._dump(profiler, message, time() - start)
+
+    def _arm(self, config: ProfileConfig):
+        self.config = config
+        self.remaining = config.calls
+
+    def _refresh(self):
+        global configs
+
+        spec = configs.get(self.profile, None)
+        if spec == self.spec:
+            return
+        # Config specs can be edited in place, so keep a copy to compare against
+        self.spec = copy.deepcopy(spec)
+
+        if spec == None:
+            self.config = None
+            self.remaining = 0
+            return
+
+        try:
+            config = ProfileConfig(**spec)
+        except Exception:
+            traceback.print_exc()
+            print("Disabling profiler, invalid profile config:", self.profile)
+            self.config = None
+            self.remaining = 0
+            return
+
+        if config != self.config:
+            self._arm(config)
+
+    def _dump(self, profiler, message, duration):
+        try:
+            config = self.config
+            name = f"profile-{int(time()*1000)}-{random.randint(0, 1000000000000)}"
+
+            os.makedirs(config.directory, exist_ok=True)
+            path = os.path.join(config.directory, f"{name}.pstats")
+            profiler.dump_stats(path)
+
+            summary = io.StringIO()
+            stats = pstats.Stats(profiler, stream=summary)
+            stats.sort_stats("cumulative").print_stats(config.top)
+            print(f"Profiled chat in {duration:.3f}s, saved to {path}")
+
+            if config.publish:
+                self._publish(name, message, path, duration, summary.getvalue())
+        except Exception:
+            traceback.print_exc()
+
+    def _publish(self, name, message, path, duration, summary):
+        global itl
+
+        profilelog = ProfileLog(
+            prompt=message, path=path, duration=duration, summary=summary
+        )
+        create_background_task(
+            itl.resource_create(
+                CLUSTER,
+                {
+                    "apiVersion": "assistants.thatone.ai/v1",
+                    "kind": "ProfileLog",
+                    "metadata": {"name": name},
+                    "spec": profilelog.model_dump(),
+                },
+                attach_prefix=True,
+            )
+        )
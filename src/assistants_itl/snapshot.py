@@ -0,0 +1,248 @@
+import asyncio
+import copy
+import json
+import mmap
+import os
+import struct
+import traceback
+from pydantic import BaseModel
+
+from .globals import *
+from .hfa_itls import Prompt, LoopSecret
+from .hfa_module import HFAssistantConfig, HFAssistant, TaskLog, Stream
+from .tool_itls import SendTool, RestApiTool, ChatGptTool, EditConfigTool
+
+# Snapshot layout: a fixed header, a JSON index of (collection, key, offset,
+# length) entries, then the JSON payloads. Payloads are sliced straight out of
+# the memory-mapped file on load.
+MAGIC = b"ITLS"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+
+RECONCILE_CONCURRENCY = 16
+
+COLLECTIONS = {
+    "tools": tools,
+    "prompts": prompts,
+    "tasklogs": tasklogs,
+    "configs": configs,
+    "loops": loops,
+    "streams": streams,
+}
+
+KINDS = {
+    "Prompt": Prompt,
+    "LoopSecret": LoopSecret,
+    "TaskLog": TaskLog,
+    "Stream": Stream,
+    "SendTool": SendTool,
+    "RestApiTool": RestApiTool,
+    "ChatGptTool": ChatGptTool,
+    "EditConfigTool": EditConfigTool,
+}
+
+
+def _dump_value(value):
+    # Fields like `groupName: str = None` reject an explicit None on load, so
+    # unset values are left out
+    if isinstance(value, BaseModel):
+        return value.model_dump(exclude_none=True)
+    return copy.deepcopy(value)
+
+
+def _load_value(key, payload):
+    kind = key.split("/")[2]
+    if kind in KINDS:
+        return KINDS[kind](**payload)
+    return payload
+
+
+def _collect_entries():
+    """Dump everything that goes into a snapshot to plain data. This runs on the
+    event loop, so the result can be serialized in a thread while resources and
+    assistants keep changing."""
+    entries = [
+        (collection_name, key, _dump_value(value))
+        for collection_name, collection in COLLECTIONS.items()
+        for key, value in list(collection.items())
+    ]
+
+    # Warm assistants the cluster hasn't claimed may have been deleted, so only
+    # claimed assistants are carried over to the next restart
+    for assistant in list(assistants.values()):
+        if not isinstance(assistant, HFAssistant) or assistant.name == None:
+            continue
+        state = {
+            "spec": _dump_value(assistant.config),
+            "examples": list(assistant.examples),
+        }
+        entries.append(("assistants", assistant.name, state))
+
+    return entries
+
+
+def save_snapshot(path=SNAPSHOT_PATH, entries=None):
+    index = []
+    payloads = []
+    offset = 0
+
+    if entries == None:
+        entries = _collect_entries()
+
+    for collection_name, key, value in entries:
+        payload = json.dumps(value, separators=(",", ":")).encode()
+        index.append([collection_name, key, offset, len(payload)])
+        payloads.append(payload)
+        offset += len(payload)
+
+    index_data = json.dumps(index, separators=(",", ":")).encode()
+
+    # Write to a temporary file first so a crash never leaves a partial snapshot.
+    # LoopSecrets are included, so only the owner may read it.
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(index_data)))
+        f.write(index_data)
+        for payload in payloads:
+            f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    result = {name: {} for name in COLLECTIONS}
+    result["assistants"] = {}
+
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return result
+
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, index_length = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                print("Ignoring incompatible snapshot:", path)
+                return result
+
+            start = HEADER.size + index_length
+            index = json.loads(data[HEADER.size : start])
+
+            for collection_name, key, offset, length in index:
+                if collection_name not in result:
+                    continue
+                payload = json.loads(data[start + offset : start + offset + length])
+                result[collection_name][key] = payload
+
+    return result
+
+
+async def warm_start(path=SNAPSHOT_PATH):
+    """Restore resources and assistants from a snapshot, then reconcile the
+    restored resources with the cluster while the assistants serve."""
+
+    try:
+        snapshot = load_snapshot(path)
+    except Exception:
+        traceback.print_exc()
+        return
+
+    restored = []
+
+    for collection_name, collection in COLLECTIONS.items():
+        for key, payload in snapshot[collection_name].items():
+            # Anything the cluster already synced is newer than the snapshot
+            if key in collection:
+                continue
+            try:
+                collection[key] = _load_value(key, payload)
+            except Exception:
+                traceback.print_exc()
+                print("Skipping snapshot entry:", key)
+                continue
+            restored.append((collection, key))
+
+    for name, state in snapshot["assistants"].items():
+        # The controller may have claimed it while an earlier assistant connected
+        if name in claimed_assistants:
+            continue
+
+        try:
+            assistant = HFAssistant(HFAssistantConfig(**state["spec"]), name)
+            assistant.examples = state["examples"]
+        except Exception:
+            traceback.print_exc()
+            continue
+
+        # Registered before connecting, so the controller reuses this instance if
+        # the cluster syncs it while connect() is waiting
+        warm_assistants[name] = assistant
+        try:
+            await assistant.connect()
+        except Exception:
+            traceback.print_exc()
+            if warm_assistants.get(name) is assistant:
+                del warm_assistants[name]
+                assistant.disconnect()
+
+    print(f"Restored {len(restored)} resources and {len(warm_assistants)} assistants")
+
+    await _reconcile(restored)
+
+
+async def _reconcile(restored):
+    # TaskLogs are never edited after they're created, so only the other
+    # resources need to be read back
+    restored = [
+        (collection, key)
+        for collection, key in restored
+        if key.split("/")[2] != "TaskLog"
+    ]
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+
+    async def reconcile_resource(collection, key):
+        async with semaphore:
+            try:
+                config = await itl.resource_read(CLUSTER, *key.split("/"))
+            except Exception:
+                traceback.print_exc()
+                return
+
+        if config == None:
+            if key in collection:
+                del collection[key]
+        elif "spec" in config:
+            try:
+                collection[key] = _load_value(key, config["spec"])
+            except Exception:
+                traceback.print_exc()
+
+    async def reconcile_assistant(name):
+        async with semaphore:
+            try:
+                config = await itl.resource_read(
+                    CLUSTER, "assistants.thatone.ai", "v1", "HFAssistant", name
+                )
+            except Exception:
+                traceback.print_exc()
+                return
+
+        if config == None and name in warm_assistants:
+            print("Removing deleted assistant:", name)
+            warm_assistants.pop(name).disconnect()
+
+    await asyncio.gather(
+        *(reconcile_resource(collection, key) for collection, key in restored),
+        *(reconcile_assistant(name) for name in list(warm_assistants)),
+    )
+
+
+async def run_snapshots(path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL):
+    # The first snapshot is written right away, since warm_start has already
+    # reconciled with the cluster
+    while True:
+        try:
+            await asyncio.to_thread(save_snapshot, path, _collect_entries())
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(interval)
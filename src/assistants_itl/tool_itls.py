@@ -1,5 +1,4 @@
 import os
-import asyncio
 from contextlib import contextmanager
 import re
 from string import Template
@@ -12,7 +11,7 @@ import traceback
 from itllib import ResourceController
 
 from .globals import *
-from .utils import ConfigTemplate
+from .utils import ConfigTemplate, create_background_task
 
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
@@ -214,8 +213,7 @@ class EditConfigTool(BaseModel):
             config_piece = config_piece.setdefault(key_piece, {})
         config_piece[key_pieces[-1]] = value
 
-        looper = asyncio.get_event_loop()
-        looper.create_task(
+        create_background_task(
             itl.resource_apply(
                 CLUSTER,
                 {
@@ -1,10 +1,17 @@
+import asyncio
 import re
+import traceback
 from pydantic import BaseModel
 import yaml
 import json
 
 from .globals import prompts, configs
 
+# Background tasks are kept here so they aren't garbage-collected before they finish
+_background_tasks = set()
+# The event loop that blocking calls in run_in_thread schedule their tasks on
+_event_loop = None
+
 
 def _resolve_config(config_path):
     global prompts, configs
@@ -84,3 +91,36 @@ class ConfigTemplate:
 
         result = self.pattern.sub(resolve, self.template)
         return conversion(result)
+
+
+def create_background_task(coro):
+    """Schedule a coroutine without awaiting it. Any exception it raises is
+    printed instead of being lost. Safe to call from run_in_thread."""
+    try:
+        looper = asyncio.get_running_loop()
+    except RuntimeError:
+        _event_loop.call_soon_threadsafe(create_background_task, coro)
+        return None
+
+    task = looper.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_finish_background_task)
+    return task
+
+
+def _finish_background_task(task):
+    _background_tasks.discard(task)
+    if task.cancelled():
+        return
+
+    exception = task.exception()
+    if exception != None:
+        traceback.print_exception(type(exception), exception, exception.__traceback__)
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run a blocking call in a worker thread so the event loop keeps handling
+    messages in the meantime."""
+    global _event_loop
+    _event_loop = asyncio.get_running_loop()
+    return await asyncio.to_thread(func, *args, **kwargs)
@@ -0,0 +1,79 @@
+import pytest
+
+from assistants_itl import snapshot
+from assistants_itl.hfa_module import HFAssistantConfig
+
+SAMPLES = {
+    "Prompt": {"prompt": "You are a helpful assistant."},
+    "LoopSecret": {
+        "loopName": "example",
+        "authenticationType": "basic",
+        "secretBasicAuth": {
+            "endpoint": "loops.example.com",
+            "username": "user",
+            "password": "password",
+        },
+        "protocols": ["wss"],
+    },
+    "TaskLog": {"prompt": "Say hi", "code": "send('hi')"},
+    "Stream": {"loopSecret": "itllib/v1/LoopSecret/example", "streamName": "chat"},
+    "SendTool": {"description": "Send a message", "stream": "chat", "join": " "},
+    "RestApiTool": {"description": "Fetch", "method": "GET", "url": "http://x"},
+    "ChatGptTool": {"description": "Ask", "model": "gpt-4", "calls": []},
+    "EditConfigTool": {
+        "description": "Edit",
+        "config": "assistants.thatone.ai/v1/Config/example",
+    },
+}
+
+
+def _round_trip(tmp_path, collection_name, key, value):
+    path = str(tmp_path / "snapshot.itls")
+    snapshot.save_snapshot(path, [(collection_name, key, value)])
+    return snapshot.load_snapshot(path)[collection_name][key]
+
+
+def test_samples_cover_every_kind():
+    assert set(SAMPLES) == set(snapshot.KINDS)
+
+
+@pytest.mark.parametrize("kind", sorted(SAMPLES))
+def test_resource_round_trip(tmp_path, kind):
+    key = f"assistants.thatone.ai/v1/{kind}/example"
+    value = snapshot.KINDS[kind](**SAMPLES[kind])
+
+    payload = _round_trip(tmp_path, "tools", key, snapshot._dump_value(value))
+
+    assert snapshot._load_value(key, payload) == value
+
+
+def test_config_round_trip(tmp_path):
+    key = "assistants.thatone.ai/v1/Config/example"
+    value = {"calls": 2, "nested": {"value": None}}
+
+    payload = _round_trip(tmp_path, "configs", key, snapshot._dump_value(value))
+
+    assert snapshot._load_value(key, payload) == value
+
+
+def test_assistant_config_round_trip(tmp_path):
+    config = HFAssistantConfig(
+        codeModel="gpt-4",
+        streams=["assistants.thatone.ai/v1/Stream/chat"],
+        header="",
+        tools={},
+        examples=[],
+    )
+
+    state = {"spec": snapshot._dump_value(config), "examples": ["a"]}
+    payload = _round_trip(tmp_path, "assistants", "example", state)
+
+    assert HFAssistantConfig(**payload["spec"]) == config
+    assert payload["examples"] == ["a"]
+
+
+def test_invalid_snapshot_is_ignored(tmp_path):
+    path = tmp_path / "snapshot.itls"
+    path.write_bytes(b"not a snapshot")
+
+    assert snapshot.load_snapshot(str(path))["streams"] == {}